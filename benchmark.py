@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import resource
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+DEFAULT_TREE = {
+    'depth': 6,
+    'fanout': 4,
+    'files_per_folder': 8,
+    'memo_ratio': 0.25,
+    'single_memo_folders': 32,
+    'seed': 0
+}
+
+# Folder mtimes are pinned to this time so the scan index treats a freshly
+# generated tree as settled
+TREE_MTIME = 1_600_000_000
+
+SCENARIOS = {
+    'dry_run': {'dry_run': True, 'index': False},
+    'delete': {'dry_run': False, 'index': False},
+    # Second dry run over an unchanged tree with a warm scan index
+    'dry_run_indexed': {'dry_run': True, 'index': True}
+}
+
+# os functions whose calls are counted, by the name they are reported under
+COUNTED_CALLS = {
+    'scandir': 'listdir',
+    'listdir': 'listdir',
+    'stat': 'stat',
+    'lstat': 'stat',
+    'remove': 'unlink',
+    'unlink': 'unlink',
+    'rmdir': 'rmdir'
+}
+
+# Step 1
+def generate_tree(root, depth=6, fanout=4, files_per_folder=8, memo_ratio=0.25, single_memo_folders=32, seed=0):
+    # Builds the same tree for the same arguments: `fanout` subfolders per
+    # level down to `depth`, `files_per_folder` files in every folder with
+    # roughly `memo_ratio` of them memo files, plus `single_memo_folders`
+    # extra folders that hold nothing but one memo file
+    rng = random.Random(seed)
+    counts = {'folders': 0, 'files': 0, 'memo_files': 0}
+    folders = []
+    level = [root]
+    for current_depth in range(depth + 1):
+        next_level = []
+        for folder_path in level:
+            folders.append(folder_path)
+            for i in range(files_per_folder):
+                if rng.random() < memo_ratio:
+                    name = f"file{i}_memo.txt"
+                    counts['memo_files'] += 1
+                else:
+                    name = f"file{i}.txt"
+                with open(os.path.join(folder_path, name), 'w') as f:
+                    f.write(name)
+                counts['files'] += 1
+            if current_depth < depth:
+                for i in range(fanout):
+                    subfolder = os.path.join(folder_path, f"folder{i}")
+                    os.mkdir(subfolder)
+                    counts['folders'] += 1
+                    next_level.append(subfolder)
+        level = next_level
+    for i, parent in enumerate(rng.sample(folders, min(single_memo_folders, len(folders)))):
+        subfolder = os.path.join(parent, f"single{i}")
+        os.mkdir(subfolder)
+        with open(os.path.join(subfolder, "only_memo.txt"), 'w') as f:
+            f.write("memo")
+        folders.append(subfolder)
+        counts['folders'] += 1
+        counts['files'] += 1
+        counts['memo_files'] += 1
+    for folder_path in reversed(folders):
+        os.utime(folder_path, (TREE_MTIME, TREE_MTIME))
+    return counts
+
+# Step 2
+def count_calls(calls):
+    # Wraps the counted os functions; returns a function that restores them
+    lock = threading.Lock()
+    originals = {}
+    for name, label in COUNTED_CALLS.items():
+        original = originals[name] = getattr(os, name)
+
+        def counted(*args, _original=original, _label=label, **kwargs):
+            with lock:
+                calls[_label] += 1
+            return _original(*args, **kwargs)
+
+        setattr(os, name, counted)
+
+    def restore():
+        for name, original in originals.items():
+            setattr(os, name, original)
+
+    return restore
+
+def run_scenario(scenario, tree, workers):
+    # Runs in a fresh process so that peak RSS belongs to this scenario only
+    options = SCENARIOS[scenario]
+    workdir = tempfile.mkdtemp(prefix='memo-bench-')
+    try:
+        # main.py logs to the working directory
+        os.chdir(workdir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import main
+        root = os.path.join(workdir, 'tree')
+        os.mkdir(root)
+        counts = generate_tree(root, **tree)
+        main.setup_logging(os.path.join(workdir, main.DEFAULT_LOG_PATH))
+        index = main.ScanIndex(os.path.join(workdir, 'index.db')) if options['index'] else None
+        if index is not None:
+            main.process_folder(root, dry_run=True, workers=workers, index=index)
+        main.log_writer.flush()
+        calls = Counter()
+        restore = count_calls(calls)
+        try:
+            start = time.perf_counter()
+            stats = main.process_folder(root, dry_run=options['dry_run'], workers=workers, index=index)
+            # Writing out the queued log records is part of the run's cost
+            main.stop_logging()
+            wall = time.perf_counter() - start
+        finally:
+            restore()
+        if index is not None:
+            index.close()
+        entries = counts['folders'] + counts['files'] + 1
+        return {
+            'wall_seconds': round(wall, 4),
+            'entries': entries,
+            'entries_per_second': round(entries / wall, 1),
+            'deleted': stats['deleted'],
+            'failed': stats['failed'],
+            'calls': {label: calls[label] for label in sorted(set(COUNTED_CALLS.values()))},
+            # ru_maxrss is in KiB on Linux
+            'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+    finally:
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_benchmarks(scenarios, tree, workers, repeat=1):
+    # Keeps the fastest of `repeat` runs of each scenario
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for scenario in scenarios:
+        best = None
+        for _ in range(repeat):
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                result = pool.submit(run_scenario, scenario, tree, workers).result()
+            if best is None or result['wall_seconds'] < best['wall_seconds']:
+                best = result
+        results[scenario] = best
+    return results
+
+# Step 3
+def compare_to_baseline(results, baseline, timing_tolerance=None):
+    # Call counts and deletions are deterministic for a given tree, so more
+    # calls or different deletions are a regression. Wall time and peak RSS depend on the
+    # machine the baseline was recorded on, so they are only compared when
+    # timing_tolerance is given, and may grow by that fraction
+    regressions = []
+    for scenario, result in results.items():
+        expected = baseline['results'].get(scenario)
+        if expected is None:
+            continue
+        for label, count in result['calls'].items():
+            if count > expected['calls'].get(label, 0):
+                regressions.append(f"{scenario}: {label} calls {expected['calls'].get(label, 0)} -> {count}")
+        if result['deleted'] != expected['deleted']:
+            regressions.append(f"{scenario}: deletions {expected['deleted']} -> {result['deleted']}")
+        if timing_tolerance is None:
+            continue
+        for metric in ('wall_seconds', 'peak_rss_kib'):
+            if result[metric] > expected[metric] * (1 + timing_tolerance):
+                regressions.append(f"{scenario}: {metric} {expected[metric]} -> {result[metric]}")
+    return regressions
+
+def print_results(results):
+    print(f"{'scenario':<18} {'wall s':>8} {'entries/s':>11} {'deleted':>8} {'listdir':>8} "
+          f"{'stat':>7} {'unlink':>7} {'rmdir':>6} {'peak RSS KiB':>13}")
+    for scenario, result in results.items():
+        calls = result['calls']
+        print(f"{scenario:<18} {result['wall_seconds']:>8.3f} {result['entries_per_second']:>11.0f} "
+              f"{result['deleted']:>8} {calls['listdir']:>8} {calls['stat']:>7} {calls['unlink']:>7} "
+              f"{calls['rmdir']:>6} {result['peak_rss_kib']:>13}")
+
+# Step 4
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the memo cleanup pipeline on a synthetic tree")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="scenario to run (default: all)")
+    parser.add_argument('--depth', type=int, default=DEFAULT_TREE['depth'])
+    parser.add_argument('--fanout', type=int, default=DEFAULT_TREE['fanout'])
+    parser.add_argument('--files-per-folder', type=int, default=DEFAULT_TREE['files_per_folder'])
+    parser.add_argument('--memo-ratio', type=float, default=DEFAULT_TREE['memo_ratio'])
+    parser.add_argument('--single-memo-folders', type=int, default=DEFAULT_TREE['single_memo_folders'])
+    parser.add_argument('--seed', type=int, default=DEFAULT_TREE['seed'])
+    parser.add_argument('--workers', type=int, default=8,
+                        help="concurrent deletions passed to process_folder (default: 8)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs per scenario, keeping the fastest (default: 3)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH,
+                        help="baseline JSON file (default: benchmark_baseline.json)")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="write the results to the baseline file")
+    parser.add_argument('--check', action='store_true',
+                        help="exit with status 1 if call counts or deletions regress against the baseline")
+    parser.add_argument('--timing-tolerance', type=float, metavar='FRACTION',
+                        help="with --check, also fail if wall time or peak RSS grow by more than FRACTION; "
+                             "only meaningful against a baseline recorded on the same machine")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    tree = {
+        'depth': args.depth,
+        'fanout': args.fanout,
+        'files_per_folder': args.files_per_folder,
+        'memo_ratio': args.memo_ratio,
+        'single_memo_folders': args.single_memo_folders,
+        'seed': args.seed
+    }
+    scenarios = args.scenario or list(SCENARIOS)
+    results = run_benchmarks(scenarios, tree, args.workers, args.repeat)
+    print_results(results)
+    report = {'tree': tree, 'workers': args.workers, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"\nBaseline written to {args.baseline}")
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['tree'] != tree or baseline['workers'] != args.workers:
+            print("\nBaseline was recorded with a different tree or worker count; not comparing.")
+            sys.exit(2)
+        regressions = compare_to_baseline(results, baseline, args.timing_tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
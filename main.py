@@ -1,120 +1,1566 @@
 import os
+import sys
 import time
+import re
+import heapq
+import json
+import fnmatch
+import datetime
+import queue
+import itertools
+import multiprocessing
+import select
+import struct
+import ctypes
+import ctypes.util
 import logging
-from pathlib import Path
+import logging.handlers
+import atexit
+import cProfile
+import sqlite3
+import argparse
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-# Setup logging with timestamps
-logging.basicConfig(
-    filename='cleanup_log.txt',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+DEFAULT_LOG_PATH = 'cleanup_log.jsonl'
+# The log writer appends at most this many records per write
+LOG_BATCH_SIZE = 1000
+
+# Deletions are latency-bound on network and DrvFs mounts, so several can
+# be kept in flight at once
+DEFAULT_WORKERS = 8
+
+DEFAULT_INDEX_PATH = 'cleanup_index.db'
+MANIFEST_VERSION = 1
+# One-letter manifest record types for each scan_tree action
+MANIFEST_OPS = {
+    'memo_file': 'f',
+    'single_memo_folder': 's',
+    'empty_folder': 'e'
+}
+INDEX_SETTLE_NS = 2 * 10**9
+
+# Step 0
+class QueueLogHandler(logging.handlers.QueueHandler):
+    # Passes records to the writer thread as they are; building the message
+    # is left to that thread, so a log call only costs an enqueue
+    def prepare(self, record):
+        return record
+
+class JsonlLogWriter(threading.Thread):
+    # Drains the log queue in the background and appends each batch of
+    # records to the log file as JSON lines, with a single write
+    def __init__(self, log_path, records):
+        super().__init__(name='log-writer', daemon=True)
+        self.log_path = log_path
+        self.records = records
+        self.file = open(log_path, 'a', encoding='utf-8')
+        self.formatter = logging.Formatter()
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.records.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            flushed = []
+            for record in batch:
+                if record is None:
+                    stopping = True
+                elif isinstance(record, threading.Event):
+                    flushed.append(record)
+                else:
+                    # One bad record must not take the writer down with it
+                    try:
+                        lines.append(self.format(record))
+                    except Exception:
+                        self.handle_error(record)
+            try:
+                self.file.write(''.join(lines))
+                self.file.flush()
+            except Exception:
+                self.handle_error(None)
+            for event in flushed:
+                event.set()
+        self.file.close()
+
+    def handle_error(self, record):
+        # Reports the current exception the way logging.Handler.handleError
+        # does, and carries on
+        if not logging.raiseExceptions or sys.stderr is None:
+            return
+        try:
+            sys.stderr.write('--- Logging error ---\n')
+            traceback.print_exc(file=sys.stderr)
+            if record is None:
+                sys.stderr.write(f'Writing to {self.log_path} failed\n')
+            else:
+                sys.stderr.write(f'Message: {record.msg!r}\nArguments: {record.args!r}\n')
+        except OSError:
+            pass
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'process': record.processName,
+            'thread': record.threadName
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatter.formatException(record.exc_info)
+        return json.dumps(entry) + '\n'
+
+    def flush(self):
+        # Waits until everything logged so far is on disk, unless the
+        # writer has already stopped
+        event = threading.Event()
+        self.records.put(event)
+        while not event.wait(1.0):
+            if not self.is_alive():
+                return
+
+    def stop(self):
+        self.records.put(None)
+        self.join()
+
+log_writer = None
+
+def setup_logging(log_path=DEFAULT_LOG_PATH, level='INFO'):
+    global log_writer
+    stop_logging()
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueLogHandler(records))
+    root.setLevel(level)
+    log_writer = JsonlLogWriter(log_path, records)
+    log_writer.start()
+    return log_writer
+
+def stop_logging():
+    global log_writer
+    if log_writer is not None and log_writer.is_alive():
+        log_writer.stop()
+    log_writer = None
+
+atexit.register(stop_logging)
+
+class Metrics:
+    # Counters and per-phase timings for a run. Scans update them once per
+    # folder and deletions once per entry, from any thread. The 'delete'
+    # phase is summed over worker threads, so it can exceed wall time.
+    COUNTERS = ('folders_scanned', 'entries_seen', 'stat_calls', 'files_deleted',
+                'folders_deleted', 'errors', 'bytes_freed')
+    PHASES = ('scan', 'delete')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Sizing deleted files costs a stat each, so it is opt-in
+        self.count_bytes = False
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = dict.fromkeys(self.COUNTERS, 0)
+            self.timings = dict.fromkeys(self.PHASES, 0.0)
+            self.start_time = time.perf_counter()
+
+    def add(self, phase=None, seconds=0.0, **counts):
+        with self.lock:
+            for name, n in counts.items():
+                self.counts[name] += n
+            if phase is not None:
+                self.timings[phase] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counts': dict(self.counts),
+                'timings': dict(self.timings),
+                'elapsed': time.perf_counter() - self.start_time
+            }
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, n in snapshot['counts'].items():
+                self.counts[name] += n
+            for phase, seconds in snapshot['timings'].items():
+                self.timings[phase] += seconds
+
+metrics = Metrics()
+
+class ProgressReporter(threading.Thread):
+    # Rewrites a one-line progress summary on stderr every interval seconds
+    def __init__(self, interval=1.0):
+        super().__init__(name='progress', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        snapshot = metrics.snapshot()
+        counts = snapshot['counts']
+        rate = counts['entries_seen'] / snapshot['elapsed'] if snapshot['elapsed'] else 0.0
+        sys.stderr.write(f"\r{counts['folders_scanned']} folders, {counts['entries_seen']} entries "
+                         f"({rate:.0f}/s), {counts['files_deleted'] + counts['folders_deleted']} deletions, "
+                         f"{counts['errors']} errors")
+        sys.stderr.flush()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.report()
+        sys.stderr.write("\n")
+
+def print_metrics():
+    snapshot = metrics.snapshot()
+    counts = snapshot['counts']
+    elapsed = snapshot['elapsed']
+    print("\nMetrics:")
+    print(f"  Folders scanned:  {counts['folders_scanned']} ({snapshot['timings']['scan']:.2f}s reading)")
+    print(f"  Entries seen:     {counts['entries_seen']} ({counts['entries_seen'] / elapsed if elapsed else 0:.0f}/s)")
+    print(f"  Stat calls:       {counts['stat_calls']}")
+    print(f"  Deletions:        {counts['files_deleted']} files, {counts['folders_deleted']} folders "
+          f"({snapshot['timings']['delete']:.2f}s across workers)")
+    print(f"  Errors:           {counts['errors']}")
+    if metrics.count_bytes:
+        print(f"  Bytes freed:      {counts['bytes_freed']}")
 
 # Step 1
 def has_memo_in_filename(filename):
     return 'memo' in filename.lower()
 
+# Step 1a
+class MemoRules:
+    # Decides which files count as memo files. Name patterns are matched
+    # case-insensitively:
+    #   substrings - anywhere in the name ('memo' matches like
+    #                has_memo_in_filename)
+    #   globs      - whole-name shell patterns, e.g. '*.tmp'
+    #   regexes    - searched anywhere in the name
+    #   extensions - name endings, with or without the leading dot
+    # Substrings, globs and extensions are folded into a single regex, so a
+    # name is checked once no matter how many of them there are. User
+    # regexes are compiled on their own, as inline flags and group numbers
+    # would not survive being pasted into one alternation.
+    # Size (bytes) and age (days since modified) limits must all hold as
+    # well; they need a stat, so they are only checked for names that
+    # already matched.
+    FIELDS = ('substrings', 'globs', 'regexes', 'extensions',
+              'min_size', 'max_size', 'min_age_days', 'max_age_days')
+
+    def __init__(self, substrings=('memo',), globs=(), regexes=(), extensions=(),
+                 min_size=None, max_size=None, min_age_days=None, max_age_days=None):
+        parts = [re.escape(s) for s in substrings]
+        parts += [r'\A' + fnmatch.translate(g) for g in globs]
+        parts += [re.escape(e if e.startswith('.') else '.' + e) + r'\Z' for e in extensions]
+        self.pattern = re.compile('|'.join(parts), re.IGNORECASE) if parts else None
+        self.regexes = []
+        for regex in regexes:
+            try:
+                self.regexes.append(re.compile(regex, re.IGNORECASE))
+            except re.error as e:
+                raise ValueError(f"invalid regex {regex!r}: {e}") from None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_age_days = min_age_days
+        self.max_age_days = max_age_days
+        self.needs_stat = any(limit is not None for limit in (min_size, max_size, min_age_days, max_age_days))
+
+    @classmethod
+    def from_file(cls, rules_path):
+        with open(rules_path, encoding='utf-8') as f:
+            rules = json.load(f)
+        if not isinstance(rules, dict):
+            raise ValueError("rules must be a JSON object")
+        for key, value in rules.items():
+            if key not in cls.FIELDS:
+                raise ValueError(f"unknown rule {key!r}; expected one of {', '.join(cls.FIELDS)}")
+            if key in cls.FIELDS[:4] and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+                raise ValueError(f"rule {key!r} must be a list of strings")
+            if key in cls.FIELDS[4:] and (isinstance(value, bool) or not isinstance(value, (int, float, type(None)))):
+                raise ValueError(f"rule {key!r} must be a number or null")
+        return cls(**rules)
+
+    def matches(self, name, path, backend):
+        if ((self.pattern is None or self.pattern.search(name) is None) and
+                not any(regex.search(name) for regex in self.regexes)):
+            return False
+        if not self.needs_stat:
+            return True
+        try:
+            size, mtime = backend.stat(path)
+        except OSError as e:
+            logging.error("Error reading file %s: %s", path, e)
+            return False
+        age_days = (time.time() - mtime) / 86400
+        return ((self.min_size is None or size >= self.min_size) and
+                (self.max_size is None or size <= self.max_size) and
+                (self.min_age_days is None or age_days >= self.min_age_days) and
+                (self.max_age_days is None or age_days <= self.max_age_days))
+
 # Step 2
-def list_folder_contents(folder_path):
+def read_folder(folder_path):
+    # Returns the names of the files, folders and other entries in a folder
+    files, folders, others = [], [], []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            # d_type answers both checks without a stat call; symlinks to
+            # folders are kept as plain entries so the walk cannot loop
+            if entry.is_dir(follow_symlinks=False):
+                folders.append(entry.name)
+            elif entry.is_file():
+                files.append(entry.name)
+            else:
+                others.append(entry.name)
+    return files, folders, others
+
+def list_folder_contents(folder_path, backend=None, rules=None):
     result = {
         'memo_files': [],
         'other_files': [],
         'folders': []
     }
-    path = Path(folder_path)
-    for item in path.iterdir():
-        if item.is_file():
-            if has_memo_in_filename(item.name):
-                result['memo_files'].append(str(item))
-            else:
-                result['other_files'].append(str(item))
-        elif item.is_dir():
-            result['folders'].append(str(item))
+    if backend is None:
+        backend = LocalBackend()
+    started = time.perf_counter()
+    files, folders, others = backend.read_folder(folder_path)
+    metrics.add('scan', time.perf_counter() - started, folders_scanned=1,
+                entries_seen=len(files) + len(folders) + len(others))
+    for name in files:
+        path = backend.join(folder_path, name)
+        if has_memo_in_filename(name) if rules is None else rules.matches(name, path, backend):
+            result['memo_files'].append(path)
+        else:
+            result['other_files'].append(path)
+    for name in others:
+        result['other_files'].append(backend.join(folder_path, name))
+    for name in folders:
+        result['folders'].append(backend.join(folder_path, name))
     return result
 
+# Step 2a
+class ScanIndex:
+    # On-disk cache of folder listings keyed by inode and mtime, so repeat
+    # runs only read the folders that changed since they were last scanned.
+    # Unchanged folders still cost one stat, because a change deep in a
+    # subtree does not touch the mtime of the folders above it.
+    def __init__(self, index_path, full_rescan=False):
+        # Sharded runs write to the index from several processes at once
+        self.db = sqlite3.connect(index_path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS folders ('
+            'path TEXT PRIMARY KEY, ino INTEGER, mtime_ns INTEGER, '
+            'files TEXT, folders TEXT, others TEXT)'
+        )
+        self.full_rescan = full_rescan
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def forget(self, root):
+        # Drops every entry under root, including folders that no longer exist
+        prefix = os.path.join(root, '')
+        self.db.execute(
+            'DELETE FROM folders WHERE path = ? OR substr(path, 1, ?) = ?',
+            (root, len(prefix), prefix)
+        )
+
+    def read_folder(self, folder_path):
+        return self.stat_and_read(folder_path)[1]
+
+    def stat_and_read(self, folder_path):
+        # Also returns the stat the listing was checked against
+        try:
+            st = os.stat(folder_path)
+        except FileNotFoundError:
+            self.forget(folder_path)
+            raise
+        metrics.add(stat_calls=1)
+        row = None
+        if not self.full_rescan:
+            row = self.db.execute(
+                'SELECT ino, mtime_ns, files, folders, others FROM folders WHERE path = ?',
+                (folder_path,)
+            ).fetchone()
+            if row is not None and row[0] == st.st_ino and row[1] == st.st_mtime_ns:
+                self.hits += 1
+                return st, tuple(names.split('\0') if names else [] for names in row[2:])
+        self.misses += 1
+        contents = read_folder(folder_path)
+        if row is not None and row[3]:
+            # Subfolders gone since the last scan, including the ones this
+            # tool deleted, would otherwise keep their entries for good
+            for name in set(row[3].split('\0')).difference(contents[1]):
+                self.forget(os.path.join(folder_path, name))
+        # A folder changed within the last couple of seconds could change
+        # again without its mtime moving on coarse-grained filesystems
+        if time.time_ns() - st.st_mtime_ns > INDEX_SETTLE_NS:
+            self.db.execute(
+                'INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?, ?)',
+                (folder_path, st.st_ino, st.st_mtime_ns, *('\0'.join(names) for names in contents))
+            )
+            self.writes += 1
+            if self.writes % 10000 == 0:
+                self.db.commit()
+        return st, contents
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+# Step 2b
+def scan_tree(root, delete_empty_folders=True, backend=None, root_parent=None, donate=None, rules=None):
+    # Walks the tree iteratively, reading every folder exactly once, and
+    # yields (action, path, parent) tuples with children before parents:
+    #   'memo_file'          - memo file to delete
+    #   'single_memo_folder' - folder whose only entry was a memo file
+    #   'empty_folder'       - folder left empty once its deletions are done
+    # Emptiness is worked out from the counts taken while scanning, assuming
+    # every planned deletion succeeds; the consumer is responsible for
+    # skipping a folder whose children could not all be deleted. Passing
+    # root_parent treats root as a subfolder, so the single-memo rule
+    # applies to it as well.
+    # donate(folder, parent, depth) may take a pending subfolder off this
+    # walk to be scanned elsewhere; it is offered the shallowest pending
+    # subfolders first, as those are likely to hold the most work. A folder
+    # that would be empty apart from donated subfolders is yielded as
+    # 'deferred_folder' instead of 'empty_folder', and whoever scans the
+    # donated subfolders decides whether it goes.
+    stack = []
+    folder_path, parent = root, root_parent
+    while True:
+        if folder_path is not None:
+            try:
+                contents = list_folder_contents(folder_path, backend, rules)
+            except OSError as e:
+                logging.error("Error reading folder %s: %s", folder_path, e)
+                metrics.add(errors=1)
+                contents = None
+            if contents is None:
+                if stack:
+                    stack[-1][3] += 1
+            elif (parent is not None and
+                    len(contents['memo_files']) == 1 and
+                    not contents['other_files'] and
+                    not contents['folders']):
+                yield 'memo_file', contents['memo_files'][0], folder_path
+                yield 'single_memo_folder', folder_path, parent
+            else:
+                if logging.getLogger().isEnabledFor(logging.INFO):
+                    logging.info("Processing folder: %s", folder_path)
+                    logging.info("Found %s memo files, %s other files, and %s folders.", len(contents['memo_files']), len(contents['other_files']), len(contents['folders']))
+                    for file in contents['memo_files']:
+                        logging.info("Memo file found: %s", file)
+                    for folder in contents['folders']:
+                        logging.info("Subfolder found: %s", folder)
+                for file in contents['memo_files']:
+                    yield 'memo_file', file, folder_path
+                # [path, parent, pending subfolders, entries that will remain,
+                #  donated or deferred subfolders]
+                stack.append([folder_path, parent, contents['folders'][::-1], len(contents['other_files']), 0])
+            folder_path = None
+        if not stack:
+            return
+        if donate is not None:
+            for depth, bottom in enumerate(stack, 1):
+                while bottom[2] and donate(bottom[2][-1], bottom[0], depth):
+                    bottom[2].pop()
+                    bottom[4] += 1
+                if bottom[2]:
+                    break
+        frame = stack[-1]
+        if frame[2]:
+            folder_path, parent = frame[2].pop(), frame[0]
+            continue
+        stack.pop()
+        path, parent, _, remaining, deferred = frame
+        if remaining or not delete_empty_folders or path == "":
+            if stack:
+                stack[-1][3] += 1
+        elif deferred:
+            yield 'deferred_folder', path, parent
+            if stack:
+                stack[-1][4] += 1
+        else:
+            yield 'empty_folder', path, parent
+
 # Step 3
 def delete_file(file_path, dry_run=False):
     if dry_run:
-        logging.info(f"[DRY RUN] Would delete file: {file_path}")
+        logging.info("[DRY RUN] Would delete file: %s", file_path)
+        metrics.add(files_deleted=1)
         return True
     try:
+        size = 0
+        if metrics.count_bytes:
+            size = os.lstat(file_path).st_size
+            metrics.add(stat_calls=1)
         os.remove(file_path)
-        logging.info(f"Deleted file: {file_path}")
+        logging.info("Deleted file: %s", file_path)
+        metrics.add(files_deleted=1, bytes_freed=size)
         return True
     except Exception as e:
-        logging.error(f"Error deleting file {file_path}: {e}")
+        logging.error("Error deleting file %s: %s", file_path, e)
+        metrics.add(errors=1)
         return False
     
 # Step 4
 def delete_folder_if_empty(folder_path, dry_run=False):
     if dry_run:
-        logging.info(f"[DRY RUN] Would delete empty folder: {folder_path}")
+        logging.info("[DRY RUN] Would delete empty folder: %s", folder_path)
+        metrics.add(folders_deleted=1)
         return True
     try:
         os.rmdir(folder_path)
-        logging.info(f"Deleted empty folder: {folder_path}")
+        logging.info("Deleted empty folder: %s", folder_path)
+        metrics.add(folders_deleted=1)
         return True
     except Exception as e:
-        logging.error(f"Error deleting folder {folder_path}: {e}")
+        logging.error("Error deleting folder %s: %s", folder_path, e)
+        metrics.add(errors=1)
         return False
     
-# Step 5
-def process_folder(folder_path, delete_empty_folders=True, dry_run=True):
-    logging.info(f"Processing folder: {folder_path}")
-    contents = list_folder_contents(folder_path)
-    logging.info(f"Found {len(contents['memo_files'])} memo files, {len(contents['other_files'])} other files, and {len(contents['folders'])} folders.")
-    for file in contents['memo_files']:
-        logging.info(f"Memo file found: {file}")
-    for folder in contents['folders']:
-        logging.info(f"Subfolder found: {folder}")
-
-    for file in contents['memo_files']:
-        delete_file(file, dry_run)
-
-    for folder in contents['folders']:
-        subfolder_path = folder
-        subfolder_contents = list_folder_contents(subfolder_path)
-        if (len(subfolder_contents['memo_files']) == 1 and 
-            not subfolder_contents['other_files'] and 
-            not subfolder_contents['folders']):
-            all_deleted = True
-            for file in subfolder_contents['memo_files']:
-                if not delete_file(file, dry_run):
-                    all_deleted = False
-            if all_deleted:
-                delete_folder_if_empty(subfolder_path, dry_run)
+# Step 4a
+class LocalBackend:
+    # Backends give scan_tree and DeleteExecutor a shared view of a tree:
+    # read_folder returns (files, folders, others) names, join builds child
+    # paths, and delete_batch runs a list of (action, path) deletions and
+    # returns whether each one succeeded.
+    batch_size = 1
+    max_workers = None
+
+    def __init__(self, index=None, manifest=None):
+        self.index = index
+        self.manifest = manifest
+
+    def exists(self, folder_path):
+        return os.path.isdir(folder_path)
+
+    def read_folder(self, folder_path):
+        if self.manifest is None:
+            if self.index is not None:
+                return self.index.read_folder(folder_path)
+            return read_folder(folder_path)
+        # A plan guards each folder with the mtime it had when it was listed
+        if self.index is not None:
+            st, contents = self.index.stat_and_read(folder_path)
+        else:
+            st = os.stat(folder_path)
+            metrics.add(stat_calls=1)
+            contents = read_folder(folder_path)
+        self.manifest.listed(folder_path, st.st_mtime_ns)
+        return contents
+
+    def join(self, folder_path, name):
+        return os.path.join(folder_path, name)
+
+    def stat(self, path):
+        st = os.stat(path)
+        metrics.add(stat_calls=1)
+        return st.st_size, st.st_mtime
+
+    def delete_batch(self, entries, dry_run):
+        return [
+            delete_file(path, dry_run) if action == 'memo_file' else delete_folder_if_empty(path, dry_run)
+            for action, path in entries
+        ]
+
+class DropboxBackend:
+    # Lists a whole Dropbox subtree with one paginated recursive listing and
+    # deletes through files_delete_batch. Dropbox removes folders together
+    # with their contents, so each folder is checked to still be empty
+    # right before its batch is sent.
+    batch_size = 1000
+    # Concurrent batch deletes in one namespace fail with
+    # too_many_write_operations
+    max_workers = 1
+    # First delay between batch status checks, and how long to wait for a
+    # batch before treating all of its entries as failed
+    poll_delay = 0.1
+    batch_timeout = 600
+
+    def __init__(self, dbx):
+        self.dbx = dbx
+        self.listed = []
+        # lower-cased folder path -> (files, folders, others) names
+        self.folders = {}
+        # lower-cased file path -> (size, server modified time)
+        self.file_stats = {}
+
+    def exists(self, folder_path):
+        import dropbox
+        if folder_path.rstrip('/') == '':
+            return True
+        try:
+            metadata = self.dbx.files_get_metadata(folder_path)
+        except dropbox.exceptions.ApiError:
+            return False
+        except dropbox_errors() as e:
+            raise OSError(f"Dropbox request failed: {e}") from e
+        return isinstance(metadata, dropbox.files.FolderMetadata)
+
+    def list_tree(self, folder_path):
+        import dropbox
+        root = folder_path.rstrip('/').lower()
+        self.folders.setdefault(root, ([], [], []))
+        try:
+            result = self.dbx.files_list_folder(folder_path.rstrip('/'), recursive=True)
+            while True:
+                for entry in result.entries:
+                    if entry.path_lower == root:
+                        continue
+                    parent = entry.path_lower.rsplit('/', 1)[0]
+                    files, folders, others = self.folders.setdefault(parent, ([], [], []))
+                    if isinstance(entry, dropbox.files.FolderMetadata):
+                        folders.append(entry.name)
+                        self.folders.setdefault(entry.path_lower, ([], [], []))
+                    elif isinstance(entry, dropbox.files.FileMetadata):
+                        files.append(entry.name)
+                        modified = entry.server_modified.replace(tzinfo=datetime.timezone.utc)
+                        self.file_stats[entry.path_lower] = (entry.size, modified.timestamp())
+                    elif not isinstance(entry, dropbox.files.DeletedMetadata):
+                        others.append(entry.name)
+                if not result.has_more:
+                    break
+                result = self.dbx.files_list_folder_continue(result.cursor)
+        except dropbox_errors() as e:
+            raise OSError(f"Dropbox listing failed: {e}") from e
+        self.listed.append(root)
+
+    def read_folder(self, folder_path):
+        key = folder_path.rstrip('/').lower()
+        if not any(root == '' or key == root or key.startswith(root + '/') for root in self.listed):
+            self.list_tree(folder_path)
+        return self.folders.get(key, ([], [], []))
+
+    def join(self, folder_path, name):
+        return f"{folder_path.rstrip('/')}/{name}"
+
+    def stat(self, path):
+        try:
+            return self.file_stats[path.lower()]
+        except KeyError:
+            raise FileNotFoundError(f"{path} is not in the Dropbox listing") from None
+
+    def folder_is_empty(self, folder_path):
+        try:
+            return not self.dbx.files_list_folder(folder_path, limit=1).entries
+        except dropbox_errors() as e:
+            logging.error("Error checking folder %s: %s", folder_path, e)
+            return False
+
+    def delete_batch(self, entries, dry_run):
+        import dropbox
+        results = [None] * len(entries)
+        paths = []
+        for i, (action, path) in enumerate(entries):
+            if dry_run:
+                if action == 'memo_file':
+                    logging.info("[DRY RUN] Would delete file: %s", path)
+                else:
+                    logging.info("[DRY RUN] Would delete empty folder: %s", path)
+                results[i] = True
+            elif action != 'memo_file' and not self.folder_is_empty(path):
+                logging.error("Error deleting folder %s: folder is not empty", path)
+                results[i] = False
+            else:
+                paths.append(i)
+        if not paths:
+            self.count_results(entries, results, dry_run)
+            return results
+        try:
+            outcome = self.wait_for_batch(self.dbx.files_delete_batch(
+                [dropbox.files.DeleteArg(entries[i][1]) for i in paths]
+            ))
+        except dropbox_errors() as e:
+            outcome = None
+            logging.error("Error running delete batch: %s", e)
+        for n, i in enumerate(paths):
+            action, path = entries[i]
+            kind = 'file' if action == 'memo_file' else 'folder'
+            if outcome is None:
+                results[i] = False
+            elif outcome.entries[n].is_success():
+                logging.info("Deleted %s: %s", 'file' if kind == 'file' else 'empty folder', path)
+                results[i] = True
+            else:
+                logging.error("Error deleting %s %s: %s", kind, path, outcome.entries[n].get_failure())
+                results[i] = False
+        self.count_results(entries, results, dry_run)
+        return results
+
+    def count_results(self, entries, results, dry_run):
+        # Sizes come from the listing, so bytes freed are always counted
+        for (action, path), ok in zip(entries, results):
+            if not ok:
+                metrics.add(errors=1)
+            elif action != 'memo_file':
+                metrics.add(folders_deleted=1)
+            elif dry_run:
+                metrics.add(files_deleted=1)
             else:
-                logging.info(f"Could not delete all memo files in {subfolder_path}, skipping folder deletion.")
+                metrics.add(files_deleted=1, bytes_freed=self.file_stats.get(path.lower(), (0, 0))[0])
+
+    def wait_for_batch(self, launch):
+        if launch.is_complete():
+            return launch.get_complete()
+        if not launch.is_async_job_id():
+            logging.error("Delete batch was not started: %s", launch)
+            return None
+        job_id = launch.get_async_job_id()
+        deadline = time.monotonic() + self.batch_timeout
+        delay = self.poll_delay
+        while True:
+            time.sleep(delay)
+            status = self.dbx.files_delete_batch_check(job_id)
+            if status.is_complete():
+                return status.get_complete()
+            if not status.is_in_progress():
+                logging.error("Delete batch %s failed: %s", job_id, status)
+                return None
+            if time.monotonic() >= deadline:
+                logging.error("Delete batch %s still running after %s seconds; giving up", job_id, self.batch_timeout)
+                return None
+            delay = min(delay * 2, 2.0)
+
+def dropbox_errors():
+    # What a Dropbox call can raise: API and auth errors from the SDK, and
+    # network errors passed straight through from requests
+    import dropbox
+    import requests
+    return dropbox.exceptions.DropboxException, requests.exceptions.RequestException
+
+def connect_dropbox():
+    import dropbox
+    from dotenv import load_dotenv
+    load_dotenv()
+    return dropbox.Dropbox(os.getenv('ACCESS_TOKEN'))
+
+# Step 4b
+class DeleteExecutor:
+    # Runs backend deletions on a thread pool, grouped into batches of
+    # backend.batch_size. A folder is only removed once every deletion
+    # inside it has finished, and is skipped if any of them failed.
+    def __init__(self, workers=DEFAULT_WORKERS, dry_run=True, backend=None):
+        self.dry_run = dry_run
+        self.backend = backend if backend is not None else LocalBackend()
+        workers = min(workers, self.backend.max_workers or workers)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # Bounds how far the scan can run ahead of the workers
+        self.slots = threading.Semaphore(max(workers * 64, self.backend.batch_size * 4))
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        # folder -> [deletions in flight, closing action, failed, parent]
+        self.pending = {}
+        self.batch = []
+        self.active = 0
+        self.deleted = 0
+        self.failed = 0
+        self.skipped = 0
+        # (folder, parent, ok) for every 'deferred_folder' action
+        self.deferred = []
+        # Whether the folder set as root was removed
+        self.root = None
+        self.root_removed = False
+        # First exception raised on a worker thread; it would otherwise
+        # leave deletions counted as active for good
+        self.error = None
+
+    def submit(self, action, path, parent, skip=False):
+        # A skipped deletion is not run, and blocks its folder's removal
+        # the same way a failed one does.
+        # A partial batch may be holding the deletions that would free a slot
+        while not self.slots.acquire(timeout=0.1):
+            self.check()
+            self.flush()
+        with self.lock:
+            self.active += 1
+            state = self.pending.get(parent)
+            if state is None:
+                state = self.pending[parent] = [0, None, False, None]
+            state[0] += 1
+            if action == 'memo_file':
+                failed = skip
+            else:
+                state = self.pending.get(path)
+                if state is not None and state[0]:
+                    # Wait for the deletions inside this folder to finish
+                    state[1], state[3] = action, parent
+                    state[2] = state[2] or skip
+                    return
+                self.pending.pop(path, None)
+                failed = skip or (state is not None and state[2])
+        self.start(action, path, parent, failed)
+
+    def start(self, action, path, parent, failed):
+        # Settling a folder without deleting it can make its parent ready in
+        # turn, so this walks up the chain of ready folders in a loop; a
+        # failure at the bottom of a deep tree would overflow the stack if
+        # each level recursed
+        while True:
+            if action == 'deferred_folder':
+                # Nothing to delete here yet; record whether the folder is
+                # still a candidate once its donated subfolders are done
+                with self.lock:
+                    self.deferred.append((path, parent, not failed))
+                ready = self.settle(parent, True, deferred=True)
+            elif failed:
+                if action == 'single_memo_folder':
+                    logging.info("Could not delete all memo files in %s, skipping folder deletion.", path)
+                ready = self.settle(parent, False, skipped=True)
+            else:
+                with self.lock:
+                    self.batch.append((action, path, parent))
+                    if len(self.batch) < self.backend.batch_size:
+                        return
+                    batch, self.batch = self.batch, []
+                self.dispatch(batch)
+                return
+            if ready is None:
+                return
+            action, path, parent, failed = ready
+
+    def dispatch(self, batch):
+        self.pool.submit(self.run, batch).add_done_callback(self.record_error)
+
+    def record_error(self, future):
+        if future.exception() is not None:
+            with self.lock:
+                if self.error is None:
+                    self.error = future.exception()
+                self.idle.notify_all()
+
+    def check(self):
+        if self.error is not None:
+            self.pool.shutdown(cancel_futures=True)
+            raise RuntimeError(f"Deletion worker failed: {self.error!r}") from self.error
+
+    def flush(self):
+        with self.lock:
+            batch, self.batch = self.batch, []
+        if batch:
+            self.dispatch(batch)
+
+    def run(self, batch):
+        started = time.perf_counter()
+        try:
+            results = self.backend.delete_batch([(action, path) for action, path, _ in batch], self.dry_run)
+        except Exception as e:
+            logging.error("Error running deletions: %s", e)
+            metrics.add(errors=len(batch))
+            results = [False] * len(batch)
+        metrics.add('delete', time.perf_counter() - started)
+        for (action, path, parent), ok in zip(batch, results):
+            if path == self.root and action != 'memo_file':
+                self.root_removed = ok
+            self.finish(parent, ok)
+
+    def finish(self, parent, ok, skipped=False, deferred=False):
+        ready = self.settle(parent, ok, skipped, deferred)
+        if ready is not None:
+            self.start(*ready)
+
+    def settle(self, parent, ok, skipped=False, deferred=False):
+        # Counts one finished entry of parent; returns parent's closing
+        # action as (action, path, parent, failed) once it can run
+        ready = None
+        with self.lock:
+            if deferred:
+                pass
+            elif ok:
+                self.deleted += 1
+            elif skipped:
+                self.skipped += 1
+            else:
+                self.failed += 1
+            state = self.pending[parent]
+            state[0] -= 1
+            if not ok:
+                state[2] = True
+            if state[0] == 0 and state[1] is not None:
+                del self.pending[parent]
+                ready = (state[1], parent, state[3], state[2])
+            elif state[0] == 0 and not state[2]:
+                del self.pending[parent]
+            self.active -= 1
+            if not self.active:
+                self.idle.notify_all()
+        self.slots.release()
+        return ready
+
+    def close(self):
+        while True:
+            self.check()
+            self.flush()
+            with self.lock:
+                if not self.active:
+                    break
+                self.idle.wait(0.1)
+        self.pool.shutdown()
+
+# Step 5
+def process_folder(folder_path, delete_empty_folders=True, dry_run=True, workers=DEFAULT_WORKERS, index=None, backend=None, root_parent=None, manifest=None, donate=None, rules=None):
+    start_time = time.time()
+    if backend is None:
+        backend = LocalBackend(index, manifest)
+    executor = DeleteExecutor(workers, dry_run, backend)
+    executor.root = folder_path
+    if index is not None and index.full_rescan:
+        index.forget(folder_path)
+    try:
+        for action, path, parent in scan_tree(folder_path, delete_empty_folders, backend, root_parent, donate, rules):
+            if manifest is not None:
+                manifest.add(action, path)
+            executor.submit(action, path, parent)
+    finally:
+        executor.close()
+        if index is not None:
+            index.commit()
+    return {
+        'deleted': executor.deleted,
+        'failed': executor.failed,
+        'removed': executor.root_removed,
+        'deferred': executor.deferred,
+        'elapsed': time.time() - start_time
+    }
+
+# Step 5c
+class ManifestWriter:
+    # Records planned deletions as JSON lines, after a header line:
+    #   ["d", folder, mtime_ns] - guard, written before a folder is first used
+    #   ["f", path]             - memo file
+    #   ["s", path]             - single-memo folder
+    #   ["e", path]             - empty folder
+    # A file is guarded by its folder; a folder by itself and its parent.
+    # The backend reports each folder's mtime as it lists it, so a change
+    # made while the rest of the subtree is scanned still fails the guard.
+    # Paths are stored absolute, so --apply can run from any directory.
+    def __init__(self, manifest_path):
+        self.file = open(manifest_path, 'w', encoding='utf-8')
+        self.file.write(json.dumps({'manifest': MANIFEST_VERSION, 'created': time.time()}) + '\n')
+        self.guarded = set()
+        # Resolved once rather than on every abspath call
+        self.cwd = os.getcwd()
+        # [path as listed, absolute path, mtime_ns] for the folder listed
+        # last and its listed ancestors; scan_tree yields every action for a
+        # folder before it lists anything outside that folder
+        self.listing = []
+
+    def listed(self, folder_path, mtime_ns):
+        while self.listing and not folder_path.startswith(os.path.join(self.listing[-1][0], '')):
+            self.listing.pop()
+        self.listing.append((folder_path, self.absolute(folder_path), mtime_ns))
+
+    def absolute(self, path):
+        return os.path.normpath(os.path.join(self.cwd, path))
+
+    def guard(self, folder_path):
+        if folder_path in self.guarded:
+            return
+        self.guarded.add(folder_path)
+        for _, path, mtime_ns in reversed(self.listing):
+            if path == folder_path:
+                break
         else:
-            process_folder(subfolder_path, delete_empty_folders, dry_run)
+            try:
+                mtime_ns = os.stat(folder_path).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+        self.write(['d', folder_path, mtime_ns])
+
+    def add(self, action, path):
+        path = self.absolute(path)
+        self.guard(os.path.dirname(path))
+        if action != 'memo_file':
+            self.guard(path)
+        self.write([MANIFEST_OPS[action], path])
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def close(self):
+        self.file.close()
+
+def apply_manifest(manifest_path, workers=DEFAULT_WORKERS):
+    # Performs the deletions recorded by a dry run, in order and without
+    # walking the tree again. Entries in a folder whose mtime changed since
+    # planning are skipped, and so is every folder above them.
+    start_time = time.time()
+    actions = {op: action for action, op in MANIFEST_OPS.items()}
+    executor = DeleteExecutor(workers, dry_run=False)
+    guards = {}
+    unchanged = {}
+
+    def check(folder_path):
+        if folder_path not in unchanged:
+            try:
+                unchanged[folder_path] = os.stat(folder_path).st_mtime_ns == guards.get(folder_path)
+            except OSError:
+                unchanged[folder_path] = False
+            if not unchanged[folder_path]:
+                logging.info("Folder %s changed since planning, skipping its entries.", folder_path)
+        return unchanged[folder_path]
+
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            header = json.loads(f.readline() or 'null')
+            if not isinstance(header, dict) or header.get('manifest') != MANIFEST_VERSION:
+                raise ValueError(f"{manifest_path} is not a version {MANIFEST_VERSION} deletion manifest")
+            for line in f:
+                record = json.loads(line)
+                if record[0] == 'd':
+                    guards[record[1]] = record[2]
+                    continue
+                action, path = actions[record[0]], record[1]
+                parent = os.path.dirname(path)
+                skip = not check(parent) or (action != 'memo_file' and not check(path))
+                executor.submit(action, path, parent, skip)
+    finally:
+        executor.close()
+    return {
+        'deleted': executor.deleted,
+        'failed': executor.failed,
+        'skipped': executor.skipped,
+        'elapsed': time.time() - start_time
+    }
+
+# Step 5a
+class Inotify:
+    # Minimal ctypes binding for Linux inotify, keeping a wd <-> path map
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+        self.paths = {}
+        self.wds = {}
+
+    def add_watch(self, folder_path):
+        if folder_path in self.wds:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder_path), ctypes.c_uint32(WATCH_MASK))
+        if wd < 0:
+            err = ctypes.get_errno()
+            logging.error("Error watching folder %s: %s", folder_path, os.strerror(err))
+            return
+        self.paths[wd] = folder_path
+        self.wds[folder_path] = wd
+
+    def remove_watches(self, folder_path):
+        # Drops the watches on a folder and everything below it
+        prefix = os.path.join(folder_path, '')
+        for path in [p for p in self.wds if p == folder_path or p.startswith(prefix)]:
+            wd = self.wds.pop(path)
+            del self.paths[wd]
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        # Returns (mask, path) pairs, waiting up to timeout seconds for the
+        # first event (forever if timeout is None)
+        events = []
+        if not self.poller.poll(None if timeout is None else int(timeout * 1000)):
+            return events
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                folder_path = self.paths.get(wd)
+                if mask & IN_IGNORED:
+                    if folder_path is not None and self.wds.get(folder_path) == wd:
+                        del self.wds[folder_path]
+                    self.paths.pop(wd, None)
+                elif mask & IN_Q_OVERFLOW:
+                    events.append((mask, None))
+                elif folder_path is not None:
+                    events.append((mask, os.path.join(folder_path, name) if name else folder_path))
+
+    def close(self):
+        os.close(self.fd)
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# Events are collected until the tree has been quiet for WATCH_DEBOUNCE
+# seconds, or for at most WATCH_MAX_DELAY seconds under constant churn
+WATCH_DEBOUNCE = 1.0
+WATCH_MAX_DELAY = 10.0
+
+class WatchBackend(LocalBackend):
+    # Local backend that puts an inotify watch on every folder it reads, so
+    # nothing created while a folder is being scanned is missed
+    def __init__(self, inotify, index=None):
+        super().__init__(index)
+        self.inotify = inotify
+
+    def read_folder(self, folder_path):
+        self.inotify.add_watch(folder_path)
+        return super().read_folder(folder_path)
+
+# Step 5b
+def settle_folders(folders, roots, backend, delete_empty_folders=True, dry_run=True, rules=None):
+    # Re-checks only the given folders, deepest first, without descending
+    # into their unchanged subfolders. A folder that gets removed puts its
+    # parent back on the queue, since it may now be empty or single-memo.
+    # The watched roots themselves are never removed.
+    heap = [(-folder_path.count(os.sep), folder_path) for folder_path in folders]
+    heapq.heapify(heap)
+    queued = set(folders)
+    while heap:
+        _, folder_path = heapq.heappop(heap)
+        queued.discard(folder_path)
+        try:
+            contents = list_folder_contents(folder_path, backend, rules)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logging.error("Error reading folder %s: %s", folder_path, e)
+            metrics.add(errors=1)
+            continue
+        emptied = (folder_path not in roots and
+                   not contents['other_files'] and
+                   not contents['folders'])
+        single_memo = emptied and len(contents['memo_files']) == 1
+        all_deleted = True
+        for file in contents['memo_files']:
+            logging.info("Memo file found: %s", file)
+            if not backend.delete_batch([('memo_file', file)], dry_run)[0]:
+                all_deleted = False
+        if not all_deleted:
+            if single_memo:
+                logging.info("Could not delete all memo files in %s, skipping folder deletion.", folder_path)
+            continue
+        if not (single_memo or (emptied and delete_empty_folders)):
+            continue
+        action = 'single_memo_folder' if single_memo else 'empty_folder'
+        if backend.delete_batch([(action, folder_path)], dry_run)[0] and not dry_run:
+            parent = os.path.dirname(folder_path)
+            if parent not in queued:
+                queued.add(parent)
+                heapq.heappush(heap, (-parent.count(os.sep), parent))
+
+def watch_folders(folder_paths, delete_empty_folders=True, dry_run=True, workers=DEFAULT_WORKERS, index=None, rules=None):
+    if not sys.platform.startswith('linux'):
+        raise OSError("Watch mode needs Linux inotify")
+    folder_paths = [os.path.normpath(folder_path) for folder_path in folder_paths]
+    inotify = Inotify()
+    backend = WatchBackend(inotify, index)
+    roots = set(folder_paths)
+    try:
+        for folder_path in folder_paths:
+            print(f"\nProcessing folder: {folder_path}")
+            stats = process_folder(folder_path, delete_empty_folders, dry_run, workers, index, backend, rules=rules)
+            print(f"Completed in {stats['elapsed']:.2f} seconds ({stats['deleted']} deletions, {stats['failed']} failed)")
+        print(f"\nWatching {len(inotify.wds)} folders for changes. Press Ctrl+C to stop.")
+        logging.info("Watching %s folders for changes.", len(inotify.wds))
+        dirty = set()
+        new_folders = set()
+        overflow = False
+        batch_start = None
+        while inotify.wds:
+            timeout = None
+            if batch_start is not None:
+                timeout = max(0.0, min(WATCH_DEBOUNCE, batch_start + WATCH_MAX_DELAY - time.time()))
+            events = inotify.read_events(timeout)
+            for mask, path in events:
+                if path is None:
+                    overflow = True
+                    continue
+                dirty.add(os.path.dirname(path))
+                if not mask & IN_ISDIR:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    new_folders.add(path)
+                elif mask & IN_MOVED_FROM:
+                    # The watches below a moved-away folder now point at
+                    # paths that no longer exist
+                    inotify.remove_watches(path)
+                    new_folders.discard(path)
+            if events and batch_start is None:
+                batch_start = time.time()
+            if batch_start is None or (events and time.time() - batch_start < WATCH_MAX_DELAY):
+                continue
+            if overflow:
+                logging.error("inotify event queue overflowed, rescanning all folders.")
+                for folder_path in folder_paths:
+                    if os.path.isdir(folder_path):
+                        process_folder(folder_path, delete_empty_folders, dry_run, workers, index, backend, rules=rules)
+            else:
+                walked = []
+                for folder_path in sorted(new_folders):
+                    if any(folder_path.startswith(os.path.join(w, '')) for w in walked):
+                        continue
+                    if os.path.isdir(folder_path):
+                        walked.append(folder_path)
+                        process_folder(folder_path, delete_empty_folders, dry_run, workers, index, backend,
+                                       os.path.dirname(folder_path), rules=rules)
+                settle_folders([f for f in dirty if f in inotify.wds or f in roots], roots, backend,
+                               delete_empty_folders, dry_run, rules)
+            if index is not None:
+                index.commit()
+            logging.info("Processed a batch of %s changed folders.", len(dirty))
+            dirty.clear()
+            new_folders.clear()
+            overflow = False
+            batch_start = None
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        inotify.close()
+
+# Step 5d
+# Per-process state for shard workers, set up by init_shard_worker
+shard_context = {}
+
+def init_shard_worker(donations, idle, options):
+    # A forked worker may have copied the lock while another thread held it
+    metrics.lock = threading.Lock()
+    metrics.count_bytes = options['count_bytes']
+    if options['log_path']:
+        setup_logging(options['log_path'], options['log_level'])
+    shard_context.update(options)
+    shard_context['donations'] = donations
+    shard_context['idle'] = idle
+    if options['index_path']:
+        shard_context['index'] = ScanIndex(options['index_path'], options['full_rescan'])
+    else:
+        shard_context['index'] = None
+
+def run_shard(shard_id, folder_path, parent):
+    # Cleans up one shard. The top level of a root is always handed back
+    # as separate shards; below that, pending subfolders are only given
+    # away while another worker is idle.
+    donations = shard_context['donations']
+    idle = shard_context['idle']
+    donated = 0
+    metrics.reset()
+
+    def donate(subfolder, folder, depth):
+        nonlocal donated
+        if parent is not None or depth > 1:
+            with idle.get_lock():
+                if idle.value <= 0:
+                    return False
+                idle.value -= 1
+        donations.put((shard_id, subfolder, folder))
+        donated += 1
+        return True
+
+    stats = process_folder(folder_path, shard_context['delete_empty_folders'], shard_context['dry_run'],
+                           shard_context['workers'], shard_context['index'], root_parent=parent, donate=donate,
+                           rules=shard_context['rules'])
+    stats['donated'] = donated
+    stats['metrics'] = metrics.snapshot()
+    # Pool workers exit without running atexit handlers
+    if log_writer is not None:
+        log_writer.flush()
+    return stats
+
+def process_folders_sharded(folder_paths, delete_empty_folders=True, dry_run=True, processes=None,
+                            workers=DEFAULT_WORKERS, index_path=None, full_rescan=False, rules=None):
+    # Spreads the roots over a process pool. Each folder whose removal
+    # depends on shards scanned elsewhere becomes a node here, and is only
+    # removed once every one of those shards has finished.
+    start_time = time.time()
+    processes = processes or os.cpu_count() or 1
+    totals = {'deleted': 0, 'failed': 0, 'shards': 0}
+    if index_path and full_rescan:
+        index = ScanIndex(index_path)
+        for folder_path in folder_paths:
+            index.forget(folder_path)
+        index.close()
+    donations = multiprocessing.Queue()
+    idle = multiprocessing.Value('i', 0)
+    options = {
+        'delete_empty_folders': delete_empty_folders,
+        'dry_run': dry_run,
+        'workers': workers,
+        'index_path': index_path,
+        'full_rescan': full_rescan,
+        'rules': rules,
+        'count_bytes': metrics.count_bytes,
+        'log_path': log_writer.log_path if log_writer is not None else None,
+        'log_level': logging.getLogger().level
+    }
+    # folder -> [shards and deferred subfolders still open, closed, kept, parent]
+    nodes = {}
+    futures = {}
+    received = {}
+    shard_ids = itertools.count()
+
+    def submit(folder_path, parent):
+        shard_id = next(shard_ids)
+        received[shard_id] = 0
+        futures[pool.submit(run_shard, shard_id, folder_path, parent)] = (shard_id, folder_path, parent)
+        with idle.get_lock():
+            idle.value = processes - len(futures)
+
+    def take_donation(block):
+        shard_id, folder_path, parent = donations.get(block)
+        received[shard_id] += 1
+        nodes.setdefault(parent, [0, False, False, None])[0] += 1
+        submit(folder_path, parent)
+
+    def remove(folder_path):
+        if delete_folder_if_empty(folder_path, dry_run):
+            totals['deleted'] += 1
+            return True
+        totals['failed'] += 1
+        return False
+
+    def child_done(folder_path, removed):
+        # Walks up the nodes that this result completes
+        while folder_path in nodes:
+            state = nodes[folder_path]
+            state[0] -= 1
+            state[2] = state[2] or not removed
+            if state[0] or not state[1]:
+                return
+            del nodes[folder_path]
+            removed = not state[2] and remove(folder_path)
+            folder_path = state[3]
 
-    if delete_empty_folders and folder_path != "":
-        contents_after = os.listdir(folder_path)
-        if not contents_after:
-            delete_folder_if_empty(folder_path, dry_run)
+    def close(folder_path, kept, parent):
+        state = nodes.setdefault(folder_path, [0, False, False, None])
+        state[1], state[3] = True, parent
+        state[2] = state[2] or kept
+        if not state[0]:
+            del nodes[folder_path]
+            removed = not state[2] and remove(folder_path)
+            child_done(parent, removed)
+
+    with ProcessPoolExecutor(processes, initializer=init_shard_worker,
+                             initargs=(donations, idle, options)) as pool:
+        for folder_path in folder_paths:
+            submit(folder_path, None)
+        while futures:
+            try:
+                while True:
+                    take_donation(False)
+            except queue.Empty:
+                pass
+            done, _ = wait(futures, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard_id, folder_path, parent = futures.pop(future)
+                stats = future.result()
+                # Every donation must be registered before the folders it
+                # blocks can be closed
+                while received[shard_id] < stats['donated']:
+                    take_donation(True)
+                del received[shard_id]
+                totals['deleted'] += stats['deleted']
+                totals['failed'] += stats['failed']
+                totals['shards'] += 1
+                metrics.merge(stats['metrics'])
+                # Deferred folders arrive children first; a deferred folder
+                # inside this shard blocks its parent if that is deferred too
+                deferred = {path for path, _, _ in stats['deferred']}
+                for path, path_parent, ok in stats['deferred']:
+                    if path != folder_path and path_parent in deferred:
+                        nodes.setdefault(path_parent, [0, False, False, None])[0] += 1
+                    close(path, not ok, path_parent)
+                if folder_path not in deferred:
+                    child_done(parent, stats['removed'])
+            with idle.get_lock():
+                idle.value = processes - len(futures)
+    totals['elapsed'] = time.time() - start_time
+    return totals
 
 # Step 6
 def main():
+    parser = argparse.ArgumentParser(description="Local Folder Memo File Cleanup Tool")
+    parser.add_argument('folders', nargs='*',
+                        help="folders to clean up (default: /mnt/c/sda/, or the whole Dropbox with --dropbox)")
+    parser.add_argument('--dropbox', action='store_true',
+                        help="clean up Dropbox paths using ACCESS_TOKEN from .env instead of local folders")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"number of concurrent deletions (default: {DEFAULT_WORKERS})")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="split the folders into shards cleaned up by this many processes (0: one per CPU)")
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH,
+                        help=f"scan index used to skip unchanged folders (default: {DEFAULT_INDEX_PATH})")
+    parser.add_argument('--no-index', action='store_true',
+                        help="read every folder without using the scan index")
+    parser.add_argument('--full-rescan', action='store_true',
+                        help="ignore and rebuild the scan index")
+    parser.add_argument('--watch', action='store_true',
+                        help="after the first pass, keep watching the folders and clean up changes as they happen (Linux only)")
+    parser.add_argument('--rules', metavar='FILE',
+                        help="JSON file of MemoRules options (substrings, globs, regexes, extensions, "
+                             "min_size, max_size, min_age_days, max_age_days) instead of matching 'memo'")
+    parser.add_argument('--delete', action='store_true',
+                        help="actually delete files and folders instead of doing a dry run")
+    parser.add_argument('--plan', metavar='MANIFEST',
+                        help="do a dry run and record the planned deletions in MANIFEST")
+    parser.add_argument('--apply', metavar='MANIFEST',
+                        help="perform the deletions recorded in MANIFEST without scanning again")
+    parser.add_argument('--log-file', default=DEFAULT_LOG_PATH,
+                        help=f"JSON-lines log file (default: {DEFAULT_LOG_PATH})")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="lowest level written to the log file (default: INFO)")
+    parser.add_argument('--progress', action='store_true',
+                        help="show live progress and throughput on stderr")
+    parser.add_argument('--count-bytes', action='store_true',
+                        help="report bytes freed (costs one stat per deleted file)")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="record cProfile data for the run's main thread in FILE")
+    args = parser.parse_args()
+    if args.watch and args.dropbox:
+        parser.error("--watch only works with local folders")
+    if args.plan and (args.delete or args.watch or args.dropbox):
+        parser.error("--plan is a local dry run and cannot be combined with --delete, --watch or --dropbox")
+    if args.apply and (args.folders or args.plan or args.watch or args.dropbox):
+        parser.error("--apply reads everything from the manifest and takes no folders")
+    if args.processes != 1 and (args.dropbox or args.watch or args.plan or args.apply):
+        parser.error("--processes only works for plain local runs")
+    if args.rules:
+        try:
+            args.rules = MemoRules.from_file(args.rules)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot load rules from {args.rules}: {e}")
+
+    setup_logging(args.log_file, args.log_level)
+    metrics.count_bytes = args.count_bytes
+    progress = ProgressReporter() if args.progress else None
+    profiler = cProfile.Profile() if args.profile else None
+    if progress is not None:
+        progress.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if progress is not None:
+            progress.stop()
+        print_metrics()
+        stop_logging()
+    if profiler is not None:
+        print(f"\nProfile written to {args.profile} (inspect with: python -m pstats {args.profile})")
+
+def existing_folders(folder_paths, backend):
+    found = []
+    for folder_path in folder_paths:
+        try:
+            exists = backend.exists(folder_path)
+        except OSError as e:
+            print(f"Folder {folder_path} could not be checked ({e}). Skipping...")
+            logging.error("Error checking folder %s: %s", folder_path, e)
+            continue
+        if not exists:
+            print(f"Folder {folder_path} not found. Skipping...")
+            logging.error("Folder %s not found.", folder_path)
+            continue
+        found.append(folder_path)
+    return found
+
+def run(args):
+    dry_run = not args.delete
+    rules = args.rules
+
     logging.info("Local Folder Memo File Cleanup Tool started")
     print("Local Folder Memo File Cleanup Tool")
     print("---------------------------------")
     
-    folder_paths = [
-        "/mnt/c/sda/"    
-    ]
-    for folder_path in folder_paths:
-        if not os.path.exists(folder_path):
-            print(f"Folder {folder_path} not found. Skipping...")
-            logging.error(f"Folder {folder_path} not found.")
-            continue
-        
+    if args.apply:
+        print(f"\nApplying manifest: {args.apply}")
+        stats = apply_manifest(args.apply, workers=args.workers)
+        print(f"Completed in {stats['elapsed']:.2f} seconds "
+              f"({stats['deleted']} deletions, {stats['failed']} failed, {stats['skipped']} skipped as changed)")
+        if stats['elapsed']:
+            print(f"\nThroughput: {stats['deleted'] / stats['elapsed']:.1f} deletions/sec")
+        logging.info("Manifest %s applied: %s deletions in %.2f seconds.", args.apply, stats['deleted'], stats['elapsed'])
+        return
+
+    manifest = ManifestWriter(args.plan) if args.plan else None
+    if args.dropbox:
+        folder_paths = args.folders or [""]
+        index = None
+        backend = DropboxBackend(connect_dropbox())
+    else:
+        folder_paths = args.folders or ["/mnt/c/sda/"]
+        index = None if args.no_index else ScanIndex(args.index, args.full_rescan)
+        backend = LocalBackend(index, manifest)
+    if args.watch:
+        watch_folders(existing_folders(folder_paths, backend), dry_run=dry_run, workers=args.workers, index=index,
+                      rules=rules)
+        if index is not None:
+            index.close()
+        return
+    if args.processes != 1:
+        folder_paths = existing_folders(folder_paths, backend)
+        if index is not None:
+            index.close()
+        print(f"\nProcessing folders: {', '.join(folder_paths)}")
+        stats = process_folders_sharded(folder_paths, dry_run=dry_run, processes=args.processes, workers=args.workers,
+                                        index_path=None if args.no_index else args.index, full_rescan=args.full_rescan,
+                                        rules=rules)
+        print(f"Completed in {stats['elapsed']:.2f} seconds "
+              f"({stats['shards']} shards, {stats['deleted']} deletions, {stats['failed']} failed)")
+        if stats['elapsed']:
+            print(f"\nThroughput: {stats['deleted'] / stats['elapsed']:.1f} deletions/sec")
+        logging.info("Sharded cleanup completed: %s deletions in %.2f seconds.", stats['deleted'], stats['elapsed'])
+        return
+
+    deleted = 0
+    elapsed = 0.0
+    for folder_path in existing_folders(folder_paths, backend):
         print(f"\nProcessing folder: {folder_path}")
-        start_time = time.time()
-        process_folder(folder_path, dry_run=True)  # Set to False to delete
-        print(f"Completed in {time.time() - start_time:.2f} seconds")
-    
-    print("\nAnalysis and cleanup process completed! Set dry_run=False to perform actual deletions.")
-    logging.info("Analysis and cleanup process completed.")
+        stats = process_folder(folder_path, dry_run=dry_run, workers=args.workers, index=index,
+                               backend=backend, manifest=manifest, rules=rules)
+        print(f"Completed in {stats['elapsed']:.2f} seconds "
+              f"({stats['deleted']} deletions, {stats['failed']} failed)")
+        deleted += stats['deleted']
+        elapsed += stats['elapsed']
+
+    if manifest is not None:
+        manifest.close()
+        print(f"\nPlanned deletions written to {args.plan}; run with --apply {args.plan} to perform them.")
+    if index is not None:
+        print(f"\nScan index: {index.hits} folders unchanged, {index.misses} folders read")
+        index.close()
+    if elapsed:
+        print(f"\nThroughput: {deleted / elapsed:.1f} deletions/sec")
+    if dry_run:
+        print("\nAnalysis and cleanup process completed! Run with --delete to perform actual deletions.")
+    else:
+        print("\nAnalysis and cleanup process completed!")
+    logging.info("Analysis and cleanup process completed: %s deletions in %.2f seconds.", deleted, elapsed)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
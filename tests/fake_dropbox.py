@@ -0,0 +1,99 @@
+import datetime
+
+from dropbox import exceptions, files
+
+MODIFIED = datetime.datetime(2020, 1, 1)
+
+class FakeDropbox:
+    # In-memory stand-in for the parts of dropbox.Dropbox that
+    # DropboxBackend uses. Paths ending in '/' are folders. Listings are
+    # split into pages of page_size entries, every delete batch runs as an
+    # async job that reports in_progress `polls` times before finishing
+    # (polls=-1 never finishes), and job_status='failed' makes the whole
+    # job fail instead.
+    def __init__(self, paths, page_size=3, polls=0, job_status='complete', fail=(), error=None):
+        # lower-cased path -> (display path, is folder)
+        self.items = {}
+        for path in paths:
+            self.items[path.rstrip('/').lower()] = (path.rstrip('/'), path.endswith('/'))
+        self.page_size = page_size
+        self.polls = polls
+        self.job_status = job_status
+        self.fail = {path.lower() for path in fail}
+        # Raised by every call, to stand in for auth or network failures
+        self.error = error
+        self.pages = {}
+        self.jobs = {}
+        self.calls = []
+
+    def remaining(self):
+        return sorted(display for display, _ in self.items.values())
+
+    def call(self, name, *args):
+        self.calls.append((name, *args))
+        if self.error is not None:
+            raise self.error
+
+    def metadata(self, key):
+        display, is_folder = self.items[key]
+        name = display.rsplit('/', 1)[1]
+        if is_folder:
+            return files.FolderMetadata(name=name, id='id:folder', path_lower=key, path_display=display)
+        return files.FileMetadata(name=name, id='id:file', path_lower=key, path_display=display, size=len(name),
+                                  rev='0123456789', client_modified=MODIFIED, server_modified=MODIFIED)
+
+    def files_get_metadata(self, path):
+        self.call('get_metadata', path)
+        key = path.rstrip('/').lower()
+        if key not in self.items:
+            raise exceptions.ApiError('request', files.GetMetadataError.path(files.LookupError.not_found), None, None)
+        return self.metadata(key)
+
+    def files_list_folder(self, path, recursive=False, limit=None):
+        self.call('list_folder', path, recursive)
+        root = path.rstrip('/').lower()
+        entries = [
+            self.metadata(key) for key in sorted(self.items)
+            if key.startswith(root + '/') and (recursive or '/' not in key[len(root) + 1:])
+        ]
+        if limit is not None:
+            return files.ListFolderResult(entries=entries[:limit], cursor='limited', has_more=False)
+        cursor = f'cursor{len(self.pages)}'
+        self.pages[cursor] = [entries[i:i + self.page_size] for i in range(0, len(entries), self.page_size)] or [[]]
+        return self.page(cursor, 0)
+
+    def files_list_folder_continue(self, cursor):
+        self.call('list_folder_continue', cursor)
+        name, number = cursor.split(':')
+        return self.page(name, int(number))
+
+    def page(self, cursor, number):
+        pages = self.pages[cursor]
+        return files.ListFolderResult(entries=pages[number], cursor=f'{cursor}:{number + 1}',
+                                      has_more=number + 1 < len(pages))
+
+    def files_delete_batch(self, args):
+        self.call('delete_batch', [arg.path for arg in args])
+        job_id = f'job{len(self.jobs)}'
+        self.jobs[job_id] = [[arg.path for arg in args], self.polls]
+        return files.DeleteBatchLaunch.async_job_id(job_id)
+
+    def files_delete_batch_check(self, job_id):
+        self.call('delete_batch_check', job_id)
+        job = self.jobs[job_id]
+        if job[1] != 0:
+            job[1] -= 1
+            return files.DeleteBatchJobStatus('in_progress')
+        if self.job_status == 'failed':
+            return files.DeleteBatchJobStatus.failed(files.DeleteBatchError.too_many_write_operations)
+        entries = []
+        for path in job[0]:
+            key = path.rstrip('/').lower()
+            if key in self.items and key not in self.fail:
+                metadata = self.metadata(key)
+                for other in [other for other in self.items if other == key or other.startswith(key + '/')]:
+                    del self.items[other]
+                entries.append(files.DeleteBatchResultEntry.success(files.DeleteBatchResultData(metadata=metadata)))
+            else:
+                entries.append(files.DeleteBatchResultEntry.failure(files.DeleteError.other))
+        return files.DeleteBatchJobStatus.complete(files.DeleteBatchResult(entries=entries))
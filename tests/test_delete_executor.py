@@ -0,0 +1,118 @@
+import logging
+import os
+import threading
+import time
+
+import pytest
+
+import main
+
+class RecordingBackend(main.LocalBackend):
+    # Deletes nothing; records the order deletions ran in, fails the paths
+    # in `fail`, and holds memo files back a little so that folders
+    # would overtake them if the executor let them
+    def __init__(self, fail=()):
+        super().__init__()
+        self.fail = set(fail)
+        self.done = []
+        self.lock = threading.Lock()
+
+    def delete_batch(self, entries, dry_run):
+        results = []
+        for action, path in entries:
+            if action == 'memo_file':
+                time.sleep(0.01)
+            with self.lock:
+                self.done.append(path)
+            results.append(path not in self.fail)
+        return results
+
+def test_folder_is_removed_only_after_its_contents():
+    backend = RecordingBackend()
+    executor = main.DeleteExecutor(workers=4, dry_run=False, backend=backend)
+    for name in ('x_memo', 'y_memo', 'z_memo'):
+        executor.submit('memo_file', f'r/a/b/{name}', 'r/a/b')
+    executor.submit('empty_folder', 'r/a/b', 'r/a')
+    executor.submit('memo_file', 'r/a/w_memo', 'r/a')
+    executor.submit('empty_folder', 'r/a', 'r')
+    executor.close()
+    assert executor.deleted == 6 and executor.failed == 0
+    done = backend.done
+    assert all(done.index('r/a/b') > done.index(f'r/a/b/{name}') for name in ('x_memo', 'y_memo', 'z_memo'))
+    assert done.index('r/a') > max(done.index('r/a/b'), done.index('r/a/w_memo'))
+
+def test_failed_memo_file_keeps_single_memo_folder_and_its_parents(caplog):
+    backend = RecordingBackend(fail={'r/a/s/only_memo'})
+    executor = main.DeleteExecutor(workers=4, dry_run=False, backend=backend)
+    with caplog.at_level(logging.INFO):
+        executor.submit('memo_file', 'r/a/s/only_memo', 'r/a/s')
+        executor.submit('single_memo_folder', 'r/a/s', 'r/a')
+        executor.submit('empty_folder', 'r/a', 'r')
+        executor.close()
+    assert backend.done == ['r/a/s/only_memo']
+    assert (executor.deleted, executor.failed, executor.skipped) == (0, 1, 2)
+    assert "Could not delete all memo files in r/a/s, skipping folder deletion." in caplog.messages
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, 'a', 'b'))
+    os.makedirs(os.path.join(root, 'single'))
+    os.makedirs(os.path.join(root, 'keep'))
+    for path in ('a/x_memo', 'a/b/y_memo', 'a/b/z_memo', 'single/only_memo', 'keep/notes', 'top_memo'):
+        with open(os.path.join(root, path), 'w') as f:
+            f.write('x')
+
+def test_dry_run_counts_what_a_real_run_deletes(tmp_path):
+    make_tree(tmp_path / 'dry')
+    make_tree(tmp_path / 'real')
+    before = sorted(os.walk(tmp_path / 'dry'))
+    dry = main.process_folder(str(tmp_path / 'dry'), dry_run=True, workers=4)
+    real = main.process_folder(str(tmp_path / 'real'), dry_run=False, workers=4)
+    assert sorted(os.walk(tmp_path / 'dry')) == before
+    # 5 memo files, the single-memo folder, then b and a once emptied
+    assert dry['deleted'] == real['deleted'] == 8
+    assert dry['failed'] == real['failed'] == 0
+    assert sorted(os.listdir(tmp_path / 'real')) == ['keep']
+
+def test_failure_under_a_deep_chain_does_not_hang(tmp_path, monkeypatch):
+    # Enough levels that walking the skipped folders by recursion would
+    # overflow the stack inside a worker thread
+    leaf = str(tmp_path / 'r')
+    os.mkdir(leaf)
+    for _ in range(1500):
+        leaf = os.path.join(leaf, 'a')
+        os.mkdir(leaf)
+    for name in ('x_memo', 'y_memo'):
+        open(os.path.join(leaf, name), 'w').close()
+    remove = os.remove
+
+    def failing_remove(path, *args, **kwargs):
+        if path.endswith('_memo'):
+            raise PermissionError(path)
+        return remove(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'remove', failing_remove)
+    stats = {}
+    runner = threading.Thread(target=lambda: stats.update(
+        main.process_folder(str(tmp_path / 'r'), dry_run=False, workers=8)), daemon=True)
+    runner.start()
+    runner.join(30)
+    assert not runner.is_alive()
+    assert stats['deleted'] == 0 and stats['failed'] == 2
+    monkeypatch.undo()
+    # The chain is too deep for the recursive rmtree that cleans up tmp_path
+    for name in ('x_memo', 'y_memo'):
+        os.remove(os.path.join(leaf, name))
+    while leaf != str(tmp_path):
+        os.rmdir(leaf)
+        leaf = os.path.dirname(leaf)
+
+def test_worker_exception_fails_the_run(monkeypatch):
+    executor = main.DeleteExecutor(workers=2, dry_run=True, backend=RecordingBackend())
+
+    def broken_finish(parent, ok, skipped=False, deferred=False):
+        raise KeyError(parent)
+
+    monkeypatch.setattr(executor, 'finish', broken_finish)
+    executor.submit('memo_file', 'r/x_memo', 'r')
+    with pytest.raises(RuntimeError, match='Deletion worker failed'):
+        executor.close()
@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+# The backend tests run offline against FakeDropbox, but still need the SDK
+# for its result and error types
+dropbox = pytest.importorskip('dropbox')
+requests = pytest.importorskip('requests')
+
+from fake_dropbox import FakeDropbox
+import main
+
+TREE = [
+    '/r/', '/r/memo_top.txt', '/r/keep.txt',
+    '/r/a/', '/r/a/x_memo.txt', '/r/a/keep.txt',
+    '/r/b/', '/r/b/only_memo.txt',
+    '/r/c/', '/r/c/d/', '/r/c/d/one_memo.txt', '/r/c/d/two_MEMO.txt',
+    '/r/e/', '/r/e/f/',
+    '/r/g/', '/r/g/h/', '/r/g/h/only_memo.txt', '/r/g/keep.txt'
+]
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(main.DropboxBackend, 'poll_delay', 0)
+
+def run(fake, dry_run=False):
+    backend = main.DropboxBackend(fake)
+    return main.process_folder('/r', dry_run=dry_run, workers=4, backend=backend)
+
+def test_listing_follows_cursor_until_has_more_is_false():
+    fake = FakeDropbox(TREE, page_size=2)
+    backend = main.DropboxBackend(fake)
+    assert backend.read_folder('/r') == (['keep.txt', 'memo_top.txt'], ['a', 'b', 'c', 'e', 'g'], [])
+    assert backend.read_folder('/r/C/d') == (['one_memo.txt', 'two_MEMO.txt'], [], [])
+    assert backend.read_folder('/r/e/f') == ([], [], [])
+    continues = [call for call in fake.calls if call[0] == 'list_folder_continue']
+    # 17 entries below the root in pages of two
+    assert len(continues) == 8
+    # The whole subtree came from the one recursive listing
+    assert [call for call in fake.calls if call[0] == 'list_folder'] == [('list_folder', '/r', True)]
+
+def test_delete_batch_polls_until_the_job_completes():
+    fake = FakeDropbox(['/r/', '/r/a_memo.txt', '/r/b_memo.txt', '/r/keep.txt'], polls=3)
+    stats = run(fake)
+    assert stats['deleted'] == 2 and stats['failed'] == 0
+    assert fake.remaining() == ['/r', '/r/keep.txt']
+    assert len([call for call in fake.calls if call[0] == 'delete_batch_check']) == 4
+
+def test_failed_job_fails_every_entry_in_the_batch():
+    fake = FakeDropbox(['/r/', '/r/a_memo.txt', '/r/b_memo.txt', '/r/keep.txt'], polls=1, job_status='failed')
+    stats = run(fake)
+    assert stats['deleted'] == 0 and stats['failed'] == 2
+    assert fake.remaining() == ['/r', '/r/a_memo.txt', '/r/b_memo.txt', '/r/keep.txt']
+
+def test_job_that_never_finishes_times_out(monkeypatch):
+    monkeypatch.setattr(main.DropboxBackend, 'batch_timeout', 0.05)
+    fake = FakeDropbox(['/r/', '/r/a_memo.txt'], polls=-1)
+    backend = main.DropboxBackend(fake)
+    assert backend.delete_batch([('memo_file', '/r/a_memo.txt')], dry_run=False) == [False]
+
+def test_failed_entry_keeps_its_folder():
+    fake = FakeDropbox(['/r/', '/r/keep.txt', '/r/a/', '/r/a/x_memo.txt', '/r/a/y_memo.txt', '/r/b/', '/r/b/z_memo.txt'],
+                       fail=['/r/a/y_memo.txt'])
+    stats = run(fake)
+    assert stats['failed'] == 1
+    assert fake.remaining() == ['/r', '/r/a', '/r/a/y_memo.txt', '/r/keep.txt']
+
+def test_folder_that_gained_an_entry_is_not_deleted():
+    fake = FakeDropbox(['/r/', '/r/keep.txt', '/r/a/', '/r/a/x_memo.txt'])
+    backend = main.DropboxBackend(fake)
+    backend.read_folder('/r')
+    fake.items['/r/a/new.txt'] = ('/r/a/new.txt', False)
+    assert backend.delete_batch([('empty_folder', '/r/a')], dry_run=False) == [False]
+    assert '/r/a' in fake.remaining()
+
+def make_local_tree(root, paths):
+    for path in paths:
+        local = os.path.join(root, path.strip('/'))
+        if path.endswith('/'):
+            os.makedirs(local, exist_ok=True)
+        else:
+            with open(local, 'w') as f:
+                f.write('x')
+
+@pytest.mark.parametrize('dry_run', [True, False])
+def test_matches_local_backend(tmp_path, dry_run):
+    fake = FakeDropbox(TREE)
+    make_local_tree(tmp_path, TREE)
+    dropbox_stats = run(fake, dry_run)
+    local_stats = main.process_folder(str(tmp_path / 'r'), dry_run=dry_run, workers=4)
+    assert dropbox_stats['deleted'] == local_stats['deleted']
+    assert dropbox_stats['removed'] == local_stats['removed']
+    local_remaining = sorted(
+        '/' + os.path.relpath(os.path.join(folder, name), tmp_path)
+        for folder, folders, files in os.walk(tmp_path) for name in folders + files
+    )
+    assert fake.remaining() == local_remaining
+    if not dry_run:
+        # Single-memo folders, folders emptied by their deletions and
+        # folders that were empty already all go; the root stays
+        assert fake.remaining() == ['/r', '/r/a', '/r/a/keep.txt', '/r/g', '/r/g/keep.txt', '/r/keep.txt']
+
+def test_exists_treats_lookup_errors_as_missing():
+    backend = main.DropboxBackend(FakeDropbox(TREE))
+    assert backend.exists('/r/a')
+    assert not backend.exists('/r/a/keep.txt')
+    assert not backend.exists('/r/missing')
+
+@pytest.mark.parametrize('error', [
+    requests.exceptions.ConnectionError('connection refused'),
+    dropbox.exceptions.AuthError('request', dropbox.auth.AuthError.invalid_access_token)
+])
+def test_request_errors_become_os_errors(error):
+    backend = main.DropboxBackend(FakeDropbox(TREE, error=error))
+    with pytest.raises(OSError):
+        backend.exists('/r/a')
+    with pytest.raises(OSError):
+        backend.read_folder('/r')
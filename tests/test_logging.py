@@ -0,0 +1,31 @@
+import json
+import logging
+
+import pytest
+
+import main
+
+@pytest.fixture
+def log_path(tmp_path):
+    yield tmp_path / 'log.jsonl'
+    main.stop_logging()
+    logging.getLogger().handlers.clear()
+
+def messages(log_path):
+    with open(log_path, encoding='utf-8') as f:
+        return [json.loads(line)['message'] for line in f]
+
+def test_bad_record_is_reported_and_later_records_are_kept(log_path, capsys):
+    writer = main.setup_logging(log_path)
+    logging.info('one')
+    logging.info('two %s %s', 'x')
+    logging.info('three')
+    writer.flush()
+    assert writer.is_alive()
+    assert messages(log_path) == ['one', 'three']
+    assert "Message: 'two %s %s'" in capsys.readouterr().err
+
+def test_flush_returns_once_the_writer_has_stopped(log_path):
+    writer = main.setup_logging(log_path)
+    main.stop_logging()
+    writer.flush()
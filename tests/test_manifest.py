@@ -0,0 +1,43 @@
+import os
+
+import main
+
+def make_tree(root):
+    for path in ('keep/notes', 'a/x_memo', 'b/z_memo', 'b/c/y_memo', 'b/c/w_memo'):
+        os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(root, path), 'w') as f:
+            f.write('x')
+
+def remaining(root):
+    return sorted(os.path.relpath(os.path.join(folder, name), root)
+                  for folder, folders, files in os.walk(root) for name in folders + files)
+
+def plan(tmp_path, monkeypatch):
+    # Plans a relative root, so applying from elsewhere needs absolute paths
+    monkeypatch.chdir(tmp_path)
+    make_tree('root')
+    manifest = main.ManifestWriter('plan.jsonl')
+    try:
+        main.process_folder('root', dry_run=True, manifest=manifest)
+    finally:
+        manifest.close()
+    elsewhere = tmp_path / 'elsewhere'
+    elsewhere.mkdir()
+    monkeypatch.chdir(elsewhere)
+    return str(tmp_path / 'plan.jsonl')
+
+def test_apply_from_another_directory_performs_the_plan(tmp_path, monkeypatch):
+    manifest_path = plan(tmp_path, monkeypatch)
+    stats = main.apply_manifest(manifest_path)
+    assert (stats['failed'], stats['skipped']) == (0, 0)
+    assert remaining(tmp_path / 'root') == ['keep', 'keep/notes']
+
+def test_apply_skips_changed_folder_and_its_ancestors(tmp_path, monkeypatch):
+    manifest_path = plan(tmp_path, monkeypatch)
+    with open(tmp_path / 'root' / 'b' / 'c' / 'new', 'w') as f:
+        f.write('x')
+    stats = main.apply_manifest(manifest_path)
+    # Both memo files in c and c itself are skipped, which keeps b as well;
+    # everything outside the changed folder is still deleted
+    assert stats['failed'] == 0 and stats['skipped'] == 4
+    assert remaining(tmp_path / 'root') == ['b', 'b/c', 'b/c/new', 'b/c/w_memo', 'b/c/y_memo', 'keep', 'keep/notes']
@@ -0,0 +1,89 @@
+import json
+import time
+
+import pytest
+
+import main
+
+def test_regexes_keep_their_own_flags_and_groups():
+    rules = main.MemoRules(substrings=(), regexes=['(?i)draft', r'(a)\1', r'(b)\1'])
+    assert rules.matches('old_DRAFT.txt', None, None)
+    assert rules.matches('aa.txt', None, None)
+    assert rules.matches('bb.txt', None, None)
+    assert not rules.matches('ab.txt', None, None)
+
+def test_regexes_combine_with_other_patterns():
+    rules = main.MemoRules(globs=['*.tmp'], regexes=[r'^\d+$'], extensions=['bak'])
+    for name in ('Memo.txt', 'x.TMP', '123', 'notes.bak'):
+        assert rules.matches(name, None, None)
+    assert not rules.matches('notes.txt', None, None)
+
+def test_invalid_regex_is_reported():
+    with pytest.raises(ValueError, match="invalid regex '\\(a'"):
+        main.MemoRules(regexes=['(a'])
+
+@pytest.mark.parametrize('rules, message', [
+    ({'regexs': ['x']}, "unknown rule 'regexs'"),
+    ({'globs': '*.tmp'}, "rule 'globs' must be a list of strings"),
+    (['memo'], "rules must be a JSON object")
+])
+def test_from_file_rejects_bad_rules(tmp_path, rules, message):
+    rules_path = tmp_path / 'rules.json'
+    rules_path.write_text(json.dumps(rules))
+    with pytest.raises(ValueError, match=message):
+        main.MemoRules.from_file(rules_path)
+
+@pytest.mark.parametrize('rules, message', [
+    ({'min_size': '1MB'}, "rule 'min_size' must be a number or null"),
+    ({'max_age_days': True}, "rule 'max_age_days' must be a number or null"),
+    ({'min_age_days': [1]}, "rule 'min_age_days' must be a number or null")
+])
+def test_from_file_rejects_non_numeric_limits(tmp_path, rules, message):
+    rules_path = tmp_path / 'rules.json'
+    rules_path.write_text(json.dumps(rules))
+    with pytest.raises(ValueError, match=message):
+        main.MemoRules.from_file(rules_path)
+
+def test_from_file_accepts_numeric_and_null_limits(tmp_path):
+    rules_path = tmp_path / 'rules.json'
+    rules_path.write_text(json.dumps({'min_size': 10, 'max_size': None, 'max_age_days': 1.5}))
+    rules = main.MemoRules.from_file(rules_path)
+    assert (rules.min_size, rules.max_size, rules.max_age_days) == (10, None, 1.5)
+
+class StatBackend:
+    # Serves (size, mtime) pairs and records which paths were stat'ed
+    def __init__(self, stats):
+        self.stats = stats
+        self.calls = []
+
+    def stat(self, path):
+        self.calls.append(path)
+        return self.stats[path]
+
+DAY = 86400
+
+@pytest.mark.parametrize('limits, size, age_days, expected', [
+    ({'min_size': 100}, 100, 0, True),
+    ({'min_size': 100}, 99, 0, False),
+    ({'max_size': 100}, 101, 0, False),
+    ({'min_age_days': 7}, 0, 8, True),
+    ({'min_age_days': 7}, 0, 6, False),
+    ({'max_age_days': 7}, 0, 8, False),
+    ({'min_size': 10, 'max_age_days': 7}, 50, 1, True),
+    ({'min_size': 10, 'max_age_days': 7}, 5, 1, False)
+])
+def test_size_and_age_limits(limits, size, age_days, expected):
+    backend = StatBackend({'dir/memo.txt': (size, time.time() - age_days * DAY)})
+    rules = main.MemoRules(**limits)
+    assert rules.matches('memo.txt', 'dir/memo.txt', backend) is expected
+    assert backend.calls == ['dir/memo.txt']
+
+def test_names_that_do_not_match_are_never_stat_checked():
+    backend = StatBackend({})
+    rules = main.MemoRules(min_size=1, max_age_days=30)
+    assert not rules.matches('notes.txt', 'dir/notes.txt', backend)
+    assert backend.calls == []
+
+def test_stat_error_means_no_match():
+    rules = main.MemoRules(min_size=1)
+    assert not rules.matches('memo.txt', 'dir/memo.txt', main.LocalBackend())
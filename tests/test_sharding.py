@@ -0,0 +1,77 @@
+import os
+import random
+
+import pytest
+
+import main
+
+def generate(root, rng, depth=0):
+    os.mkdir(root)
+    for i in range(rng.randint(0, 6)):
+        roll = rng.random()
+        if roll < 0.3:
+            open(os.path.join(root, f'a{i}_memo.txt'), 'w').close()
+        elif roll < 0.45:
+            open(os.path.join(root, f'f{i}.txt'), 'w').close()
+        elif depth < 5:
+            generate(os.path.join(root, f'd{i}'), rng, depth + 1)
+
+def generate_emptying(root):
+    # Every folder only holds memo files and subfolders, so the root
+    # empties only once all the shards scanning its subtree are done
+    os.mkdir(root)
+    for i in range(12):
+        folder = os.path.join(root, f'd{i}')
+        os.makedirs(os.path.join(folder, 'inner'))
+        for path in ('x_memo', 'y_memo', 'inner/x_memo', 'inner/y_memo'):
+            open(os.path.join(folder, path), 'w').close()
+
+def snapshot(base):
+    return sorted(os.path.relpath(os.path.join(folder, name), base)
+                  for folder, folders, files in os.walk(base) for name in folders + files)
+
+def run_both(tmp_path, make_roots, processes, dry_run):
+    # Builds the same roots twice and cleans one copy in a single process
+    # and the other in shards
+    results = []
+    for mode in ('single', 'sharded'):
+        base = tmp_path / mode
+        base.mkdir()
+        roots = make_roots(base)
+        if mode == 'single':
+            deleted = sum(main.process_folder(root, dry_run=dry_run)['deleted'] for root in roots)
+            stats = None
+        else:
+            stats = main.process_folders_sharded(roots, dry_run=dry_run, processes=processes)
+            deleted = stats['deleted']
+        results.append((deleted, snapshot(base)))
+    return results, stats
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('processes', [3, 4])
+@pytest.mark.parametrize('dry_run', [True, False])
+def test_sharded_run_matches_single_process(tmp_path, seed, processes, dry_run):
+    def make_roots(base):
+        roots = []
+        for k in range(2):
+            root = str(base / f'r{k}')
+            generate(root, random.Random(seed * 10 + k))
+            roots.append(root)
+        return roots
+
+    (single, sharded), stats = run_both(tmp_path, make_roots, processes, dry_run)
+    assert sharded == single
+    assert stats['failed'] == 0
+
+@pytest.mark.parametrize('processes', [3, 4])
+def test_root_emptied_by_donated_shards_is_removed(tmp_path, processes):
+    def make_roots(base):
+        root = str(base / 'r')
+        generate_emptying(root)
+        return [root]
+
+    (single, sharded), stats = run_both(tmp_path, make_roots, processes, dry_run=False)
+    assert sharded == single
+    # 48 memo files, 24 folders and the root itself
+    assert single == (73, [])
+    assert stats['shards'] > 1